@@ -0,0 +1,34 @@
+# Benchmark batch roulette simulation against the scalar Roulette.play loop
+import argparse
+import time
+from bot import Roulette
+from roulette_sim import RouletteSimulator
+
+def parse_arguments():
+    # Parse command-line arguments
+    parser = argparse.ArgumentParser(description="Roulette simulation benchmark")
+    parser.add_argument("--spins", type=int, default=1_000_000, help="Spins to simulate")
+    parser.add_argument("--bet", default="red", help="Bet to place on every spin")
+    return parser.parse_args()
+
+def main():
+    args = parse_arguments()
+    roulette = Roulette(seed=1)
+    simulator = RouletteSimulator(roulette)
+
+    start = time.perf_counter()
+    total = 0
+    for _ in range(args.spins):
+        total += roulette.play(1, args.bet)[3]
+    scalar = time.perf_counter() - start
+
+    start = time.perf_counter()
+    result = simulator.simulate(args.bet, args.spins, seed=1)
+    batch = time.perf_counter() - start
+
+    print(f"Scalar play: {args.spins} spins in {scalar:.3f}s, EV {total / args.spins - 1:+.4f}")
+    print(f"Batch:       {args.spins} spins in {batch:.3f}s, EV {result.expected_value:+.4f}")
+    print(f"Speedup:     {scalar / batch:.0f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+# Benchmark the bot runtime joining many channels from one process
+# Start the server first with: python server.py
+import argparse
+import time
+import tracemalloc
+from bot import BotRuntime
+
+def parse_arguments():
+    # Parse command-line arguments
+    parser = argparse.ArgumentParser(description="Bot runtime benchmark")
+    parser.add_argument("--host", default="::1", help="Server to connect to")
+    parser.add_argument("--port", type=int, default=6667, help="Port to connect to")
+    parser.add_argument("--channels", type=int, default=100, help="Number of channels to join")
+    parser.add_argument("--timeout", type=float, default=30, help="Seconds to wait for every JOIN")
+    return parser.parse_args()
+
+def main():
+    args = parse_arguments()
+    channels = [f"#bench{i}" for i in range(args.channels)]
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    runtime = BotRuntime()
+    bot = runtime.create_bot(args.host, args.port, channels, "BenchBot")
+    if bot is None:
+        return
+    base_memory, _ = tracemalloc.get_traced_memory()
+
+    # Drive the loop until every channel has user state
+    deadline = time.monotonic() + args.timeout
+    while len(bot.channels) < len(channels) and time.monotonic() < deadline:
+        runtime.run_once(0.1)
+    elapsed = time.perf_counter() - start
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    joined = len(bot.channels)
+    print(f"Joined {joined}/{len(channels)} channels in {elapsed * 1000:.1f} ms")
+    if joined:
+        print(f"Memory per channel: {(memory - base_memory) / joined:.0f} bytes")
+    runtime.shutdown()
+
+if __name__ == "__main__":
+    main()
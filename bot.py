@@ -3,9 +3,40 @@ import socket
 import random
 import time
 import argparse
+import selectors
+import heapq
+import importlib.util
+import os
+from collections import deque
+from channel import channel_key
+from tracing import Tracer
+
+# IRC lines are limited to 512 bytes including the trailing CRLF
+MAX_LINE_BYTES = 512
+# Room left for the ":nick!user@host " prefix the server adds when relaying
+PREFIX_RESERVE = 100
+# Separator used when packing several short replies into one PRIVMSG
+COALESCE_SEPARATOR = " | "
+
+# Outbound lanes, lower number is sent first
+LANE_HIGH = 0
+LANE_NORMAL = 1
+HIGH_PRIORITY_COMMANDS = {"PONG", "KICK"}
+
+# Seconds between sweeps of expired command cooldowns
+COOLDOWN_SWEEP_INTERVAL = 60
+
+# Nicknames an unattended bot tries before giving up
+MAX_NICK_ATTEMPTS = 10
+
+# Plugins next to this file, so the bot finds them whatever directory it is started from
+PLUGIN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "plugins")
 
 # User class to represent individual users
 class User:
+    # Slots keep per-user memory small when the bot sits in many channels
+    __slots__ = ("username", "balance", "slap_count", "slapped")
+
     def __init__(self, username, balance=1000, slap_count=0, slapped=False):
         self.username = username
         self.balance = balance
@@ -16,16 +47,31 @@ class User:
 class Users:
     def __init__(self):
         self.users = {}
+        # Usernames in a list for O(1) random picks, and each name's position in it
+        self.names = []
+        self.positions = {}
+        # How many users have slapped the bot
+        self.slapped_count = 0
 
     def add_user(self, username):
         # Add a new user if they don't already exist
         if username not in self.users:
             self.users[username] = User(username)
+            self.positions[username] = len(self.names)
+            self.names.append(username)
 
     def remove_user(self, username):
         # Remove a user if they exist
         if username in self.users:
+            if self.users[username].slapped:
+                self.slapped_count -= 1
             del self.users[username]
+            # Move the last name into the freed slot so removal stays O(1)
+            position = self.positions.pop(username)
+            last = self.names.pop()
+            if last != username:
+                self.names[position] = last
+                self.positions[last] = position
 
     def update_user(self, username, balance=None, slap_count=None, slapped=None):
         # Update user attributes if they exist
@@ -35,33 +81,81 @@ class Users:
             if slap_count is not None:
                 self.users[username].slap_count = slap_count
             if slapped is not None:
+                if slapped != self.users[username].slapped:
+                    self.slapped_count += 1 if slapped else -1
                 self.users[username].slapped = slapped
 
     def get_user(self, username):
         # Retrieve a user object
         return self.users.get(username)
 
+    def has_user(self, username):
+        # Check if a user is in the channel
+        return username in self.users
+
     def get_all_users(self):
         # Get a set of all usernames
         return set(self.users.keys())
 
+    def random_user(self, exclude=()):
+        # Pick a random username that is not in exclude, or None if there is none
+        excluded = sum(1 for username in set(exclude) if username in self.users)
+        if len(self.names) <= excluded:
+            return None
+        while True:
+            username = random.choice(self.names)
+            if username not in exclude:
+                return username
+
     def change_username(self, old_username, new_username):
-        # Change a user's username
-        if old_username in self.users:
+        # Change a user's username, returns False if it could not be applied
+        if old_username in self.users and new_username not in self.users:
             user = self.users[old_username]
             user.username = new_username
             self.users[new_username] = user
             del self.users[old_username]
+            position = self.positions.pop(old_username)
+            self.names[position] = new_username
+            self.positions[new_username] = position
+            return True
+        return False
+
+    def sync(self, usernames):
+        # Make the user set match a full NAMES list, keeping state for users already known
+        for username in self.get_all_users() - usernames:
+            self.remove_user(username)
+        for username in usernames:
+            self.add_user(username)
 
     def get_leaderboard(self):
         # Return users sorted by balance in descending order
         return sorted(self.users.values(), key=lambda x: x.balance, reverse=True)
 
+# FunFacts class to load the fun fact file once and share it between channels
+class FunFacts:
+    def __init__(self, path='./funfacts.txt'):
+        with open(path) as f:
+            self.facts = f.read().splitlines()
+
+    def get_random(self):
+        # Get a random fun fact
+        return random.choice(self.facts)
+
 class Roulette:
-    def __init__(self):
-        # Initialize roulette numbers and colors
+    def __init__(self, seed=None):
+        # Initialize roulette numbers and colors, a seed makes every spin reproducible
         self.numbers = list(range(37))
         self.colors = ['green'] + ['red', 'black'] * 18
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.streams = {}
+
+    def stream(self, channel):
+        # Get the random stream for a channel, seeded from the wheel seed and channel name
+        if channel not in self.streams:
+            seed = None if self.seed is None else f"{self.seed}:{channel}"
+            self.streams[channel] = random.Random(seed)
+        return self.streams[channel]
 
     def is_odd(self, n):
         # Check if a number is odd
@@ -87,9 +181,18 @@ class Roulette:
         else:
             return None
 
-    def play(self, amount, bet):
+    def spin(self, rng=None):
+        # Spin the wheel using rng, or the wheel's own stream
+        return (rng or self.rng).choice(self.numbers)
+
+    def play(self, amount, bet, rng=None):
         # Simulate a roulette spin
-        result = random.choice(self.numbers)
+        result = self.spin(rng)
+        color, win, winnings = self.settle(result, amount, bet)
+        return result, color, win, winnings
+
+    def settle(self, result, amount, bet):
+        # Work out the color, win flag and winnings of a bet for a given result
         color = self.colors[result]
         is_result_odd = self.is_odd(result)
         dozen = self.get_dozen(result)
@@ -120,44 +223,337 @@ class Roulette:
                 win = True
                 winnings = amount * 36
         
-        return result, color, win, winnings
+        return color, win, winnings
+
+# SendQueue class to pace outbound lines so the server does not flood-kick us
+class SendQueue:
+    def __init__(self, rate=2.0, burst=5):
+        # rate is lines per second, burst is how many lines may go back to back
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.last_refill = time.monotonic()
+        self.lanes = [deque(), deque()]
+
+    def put(self, line, lane=LANE_NORMAL):
+        # Queue a line on the given lane
+        self.lanes[lane].append(line)
+
+    def pending(self):
+        # Number of lines waiting to be sent
+        return sum(len(lane) for lane in self.lanes)
+
+    def refill(self, now):
+        # Add tokens for the time elapsed since the last refill
+        self.tokens = min(self.burst, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+    def poll(self, now=None):
+        # Return (line, 0) if a line may be sent now, otherwise (None, seconds to wait)
+        if now is None:
+            now = time.monotonic()
+        if not self.pending():
+            return None, None
+        self.refill(now)
+        if self.tokens < 1:
+            return None, (1 - self.tokens) / self.rate
+        self.tokens -= 1
+        return self.next_line(), 0
+
+    def next_line(self):
+        # Take the next line from the highest priority lane, packing short PRIVMSGs
+        for lane in self.lanes:
+            if lane:
+                line = lane.popleft()
+                return self.coalesce(line, lane)
+        return None
+
+    def coalesce(self, line, lane):
+        # Merge following PRIVMSGs to the same target while the result fits in one line
+        head, target, text = split_privmsg(line)
+        if head is None:
+            return line
+        limit = MAX_LINE_BYTES - PREFIX_RESERVE
+        size = len(line.encode())
+        while lane:
+            next_head, next_target, next_text = split_privmsg(lane[0])
+            if next_head is None or next_target != target:
+                break
+            extra = len((COALESCE_SEPARATOR + next_text).encode())
+            if size + extra > limit:
+                break
+            lane.popleft()
+            text += COALESCE_SEPARATOR + next_text
+            size += extra
+        return f"{head}{text}\r\n"
+
+def split_privmsg(line):
+    # Split "PRIVMSG <target> :<text>" into (head, target, text), or Nones if not a PRIVMSG
+    if not line.startswith("PRIVMSG "):
+        return None, None, None
+    head, sep, text = line.partition(" :")
+    if not sep:
+        return None, None, None
+    return head + sep, head.split()[1], text.rstrip("\r\n")
+
+def line_lane(line):
+    # Pick the outbound lane for a line based on its command
+    command = line.split(" ", 1)[0].upper()
+    return LANE_HIGH if command in HIGH_PRIORITY_COMMANDS else LANE_NORMAL
+
+def parse_line(line):
+    # Split a raw IRC line into (prefix, command, params), the trailing parameter is kept whole
+    if line.startswith("@"):
+        # Drop IRCv3 message tags
+        line = line.partition(" ")[2]
+    prefix = ""
+    if line.startswith(":"):
+        prefix, _, line = line[1:].partition(" ")
+    line, sep, trailing = line.partition(" :")
+    params = line.split()
+    if sep:
+        params.append(trailing)
+    command = params.pop(0).upper() if params else ""
+    return prefix, command, params
+
+# Command class describing one registered bot command
+class Command:
+    __slots__ = ("name", "handler", "cooldown", "min_args", "max_args", "usage")
+
+    def __init__(self, name, handler, cooldown=0, min_args=0, max_args=None, usage=None):
+        # handler is called as handler(bot, channel, username, args)
+        self.name = name
+        self.handler = handler
+        self.cooldown = cooldown
+        self.min_args = min_args
+        self.max_args = max_args
+        self.usage = usage or f"!{name}"
+
+    def accepts(self, count):
+        # Check the number of arguments is in range
+        return count >= self.min_args and (self.max_args is None or count <= self.max_args)
+
+# CommandRegistry class to dispatch "!name args" messages with a single dict lookup
+class CommandRegistry:
+    def __init__(self, plugin_dir=None, tracer=None):
+        self.commands = {}
+        # When set, every handler is timed into the tracer's histograms
+        self.tracer = tracer
+        # Plugin command name -> path of its module, imported on first use
+        self.plugins = {}
+        # (bot, channel, username, command) -> time the command may be used again
+        self.cooldowns = {}
+        # Cooldown keys already told to wait, later attempts in the window are dropped silently
+        self.cooldown_notified = set()
+        # When expired cooldowns were last swept out
+        self.last_sweep = time.monotonic()
+        self.fallback = None
+        if plugin_dir:
+            self.discover_plugins(plugin_dir)
+
+    def register(self, name, handler, cooldown=0, min_args=0, max_args=None, usage=None):
+        # Register a command under its name without the leading "!"
+        if self.tracer:
+            handler = self.tracer.wrap(f"!{name.lower()}", handler)
+        self.commands[name.lower()] = Command(name.lower(), handler, cooldown, min_args, max_args, usage)
+
+    def discover_plugins(self, plugin_dir):
+        # List plugin files without importing them so startup stays fast
+        if not os.path.isdir(plugin_dir):
+            return
+        for filename in os.listdir(plugin_dir):
+            name, ext = os.path.splitext(filename)
+            if ext == ".py" and not name.startswith("_") and name.lower() not in self.commands:
+                self.plugins[name.lower()] = os.path.join(plugin_dir, filename)
+
+    def plugin_names(self):
+        # Names of plugin commands, loaded or not
+        return sorted(self.plugins)
+
+    def lookup(self, name):
+        # Find a command, importing its plugin the first time it is used
+        command = self.commands.get(name)
+        if command is None and name in self.plugins:
+            command = self.load_plugin(name)
+        return command
+
+    def load_plugin(self, name):
+        # Import a plugin module from the file we listed and register its handle() function
+        try:
+            spec = importlib.util.spec_from_file_location(f"plugins.{name}", self.plugins[name])
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+        except Exception as e:
+            print(f"Error: Failed to load plugin {name}. {str(e)}")
+            del self.plugins[name]
+            return None
+        self.register(name, module.handle,
+                      getattr(module, "COOLDOWN", 0),
+                      getattr(module, "MIN_ARGS", 0),
+                      getattr(module, "MAX_ARGS", None),
+                      getattr(module, "USAGE", None))
+        return self.commands[name]
+
+    def dispatch(self, bot, channel, username, msg):
+        # Run the command named by the first token of msg
+        parts = msg[1:].split()
+        if not parts:
+            return
+        name = parts[0].lower()
+        args = parts[1:]
+        command = self.lookup(name)
+        if command is None:
+            if self.fallback:
+                self.fallback(bot, channel, username, args)
+            return
+        if not command.accepts(len(args)):
+            bot.send_data(f"PRIVMSG {channel} :Wrong format. Use: {command.usage}\r\n")
+            return
+        now = time.monotonic()
+        key = (bot, channel, username, name)
+        if command.cooldown:
+            ready_at = self.cooldowns.get(key, 0)
+            if now < ready_at:
+                if key not in self.cooldown_notified:
+                    self.cooldown_notified.add(key)
+                    bot.send_data(f"PRIVMSG {channel} :{username}, wait {ready_at - now:.0f}s before using !{name} again.\r\n")
+                return
+        # A handler returns False when it rejected the arguments, that does not start the cooldown
+        if command.handler(bot, channel, username, args) is not False and command.cooldown:
+            self.cooldowns[key] = now + command.cooldown
+            self.cooldown_notified.discard(key)
+        self.sweep_cooldowns(now)
+
+    def sweep_cooldowns(self, now):
+        # Drop expired cooldowns, at most once a minute
+        if now - self.last_sweep < COOLDOWN_SWEEP_INTERVAL:
+            return
+        self.last_sweep = now
+        for key in [key for key, ready_at in self.cooldowns.items() if ready_at <= now]:
+            del self.cooldowns[key]
+            self.cooldown_notified.discard(key)
 
 class Bot:
-    def __init__(self, host, port, channel, nick):
-        # Initialize bot with connection details
+    def __init__(self, host, port, channels, nick, rate=2.0, burst=5, roulette=None, facts=None, interactive=True, commands=None, admins=()):
+        # Initialize bot with connection details, channels may be a list or "#a,#b"
+        if isinstance(channels, str):
+            channels = channels.split(",")
         self.irc = socket.socket(socket.AF_INET6, socket.SOCK_STREAM)
-        self.users = Users()
-        self.roulette = Roulette()
+        self.roulette = roulette or Roulette()
+        self.facts = facts or FunFacts()
+        self.commands = commands or default_commands()
         self.host = host
         self.port = port
-        self.channel = channel
+        self.wanted_channels = [c for c in channels if c]
+        # Per-channel user state, filled in once our own JOIN comes back
+        self.channels = {}
+        # NAMES chunks collected until 366, and channels we have asked NAMES for
+        self.names_pending = {}
+        self.names_requested = set()
         self.nick = nick
-        self.running = True
+        # Nicks or nick!user@host masks allowed to use admin commands like !trace
+        self.admins = set(admins)
+        # Full nick!user@host prefix of the PRIVMSG being handled
+        self.sender = ""
+        self.interactive = interactive
+        self.send_queue = SendQueue(rate, burst)
+        self.runtime = None
+        self.buffer = ""
+        self.outbuf = bytearray()
+        self.user_sent = False
+        # The nick we were started with, and how many fallbacks we have tried
+        self.base_nick = nick
+        self.nick_attempts = 0
+        self.connected = False
+        self.quitting = False
 
     def print_data(self, direction, data):
         # Print data for debugging
         print(f"{direction}: {data}")
 
     def send_data(self, data):
-        # Send data to the IRC server
-        self.print_data("SENT", data)
-        self.irc.send(data.encode())
+        # Queue data for the IRC server, PONG and KICK jump ahead of chat replies
+        self.send_queue.put(data, line_lane(data))
+
+    def connect(self):
+        # Connect to the IRC server and start registration
+        self.irc.connect((self.host, self.port))
+        self.irc.setblocking(False)
+        self.connected = True
+        self.send_data(f"NICK {self.nick}\r\n")
+
+    def on_readable(self):
+        # Read what the server sent and handle every complete line
+        try:
+            data = self.irc.recv(4096)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            print(f"Socket error occurred: {e}")
+            self.close()
+            return
+        if not data:
+            print("Connection closed by the server.")
+            self.close()
+            return
+        self.buffer += data.decode("utf-8", errors="ignore")
+        while "\n" in self.buffer:
+            line, self.buffer = self.buffer.split("\n", 1)
+            line = line.rstrip("\r")
+            if not line:
+                continue
+            self.print_data("RECEIVED", line)
+            try:
+                self.handle_line(line)
+            except Exception as e:
+                print(f"An error occurred: {e}")
+
+    def flush(self, now):
+        # Move the lines the rate limiter allows into the output buffer and write it out
+        # Returns how long to wait before more lines may be sent, or None if the queue is empty
+        while True:
+            line, wait = self.send_queue.poll(now)
+            if line is None:
+                break
+            self.print_data("SENT", line)
+            self.outbuf += line.encode()
+        if self.outbuf:
+            try:
+                sent = self.irc.send(self.outbuf)
+                del self.outbuf[:sent]
+            except BlockingIOError:
+                pass
+            except OSError as e:
+                print(f"Socket error occurred: {e}")
+                self.close()
+                return None
+        if self.quitting and not self.outbuf and wait is None:
+            self.close()
+        return wait
+
+    def quit(self, reason):
+        # Send QUIT and close the connection once the queue has drained
+        if self.connected and not self.quitting:
+            self.send_data(f"QUIT :{reason}\r\n")
+            self.quitting = True
+
+    def close(self):
+        # Close the connection and drop it from the runtime
+        if not self.connected:
+            return
+        self.connected = False
+        if self.runtime:
+            self.runtime.remove_bot(self)
+        self.irc.close()
+        print(f"Connection to {self.host}:{self.port} closed.")
 
-    def receive_data(self):
-        # Receive data from the IRC server
-        data = self.irc.recv(2048).decode("utf-8", errors="ignore").strip("\r\n")
-        self.print_data("RECEIVED", data)
-        return data
+    def call_later(self, delay, callback):
+        # Run callback after delay seconds without blocking the other channels
+        self.runtime.call_later(delay, callback)
 
     def getFunFacts(self):
         # Get a random fun fact
-        return random.choice(self.turnFunFactFileIntoList())
-
-    def turnFunFactFileIntoList(self):
-        # Read fun facts from a file
-        with open('./funfacts.txt') as f:
-            lines = f.read().splitlines()
-        return lines
+        return self.facts.get_random()
 
     def show_commands(self):
         # Display available bot commands
@@ -171,258 +567,475 @@ class Bot:
             "!bal -lb - Show leaderboard",
             "Roulette bets: red/black, odd/even, 1-12/13-24/25-36, 1-18/19-36, or 0-36"
         ]
+        plugins = self.commands.plugin_names()
+        if plugins:
+            cmds.append("Plugins: " + ", ".join(f"!{name}" for name in plugins))
         return "\n".join(cmds)
 
-    def get_bal(self, username):
-        # Get a user's balance
-        user = self.users.get_user(username)
+    def get_bal(self, channel, username):
+        # Get a user's balance in a channel
+        user = self.channels[channel].get_user(username)
         return user.balance if user else 0
 
-    def update_bal(self, username, amount):
-        # Update a user's balance
-        user = self.users.get_user(username)
+    def update_bal(self, channel, username, amount):
+        # Update a user's balance in a channel
+        users = self.channels.get(channel)
+        user = users.get_user(username) if users else None
         if user:
-            self.users.update_user(username, balance=user.balance + amount)
+            users.update_user(username, balance=user.balance + amount)
+
+    def handle_line(self, line):
+        # Dispatch one line from the server
+        prefix, command, params = parse_line(line)
+        nick = prefix.split("!")[0]
+        if command == "PING":
+            self.handle_ping(params)
+        elif command in ("433", "432"):  # Nickname is already in use or erroneous
+            self.handle_nick_error()
+            return
+        elif command == "PRIVMSG" and len(params) == 2:
+            self.sender = prefix
+            self.proccess_privmsg(nick, params[0], params[1])
+        elif command == "001":  # Welcome message, we're connected
+            self.join_channels()
+        elif command == "JOIN" and params:
+            self.handle_user_join(params[0], nick)
+        elif command == "PART" and params:
+            self.handle_user_leave(params[0], nick)
+        elif command == "QUIT":
+            self.handle_user_quit(nick, params)
+        elif command == "KICK" and len(params) >= 2:
+            self.handle_user_leave(params[0], params[1])
+        elif command == "353" and len(params) >= 4:  # NAMES reply
+            self.process_user_list(params[2], params[3])
+        elif command == "366" and len(params) >= 2:  # End of NAMES
+            self.end_user_list(params[1])
+        elif command == "NICK" and params:
+            self.handle_nick_change(nick, params[-1])
+
+        if not self.user_sent:
+            self.send_data(f"USER {self.nick} 0 * :{self.nick}\r\n")
+            self.user_sent = True
 
-    def handle_ping(self, resp):
+    def join_channels(self):
+        # Join every wanted channel, packing as many names as fit into each JOIN
+        budget = MAX_LINE_BYTES - len("JOIN \r\n")
+        line = ""
+        for channel in self.wanted_channels:
+            if line and len(line) + len(",") + len(channel) > budget:
+                self.send_data(f"JOIN {line}\r\n")
+                line = ""
+            line = f"{line},{channel}" if line else channel
+        if line:
+            self.send_data(f"JOIN {line}\r\n")
+
+    def handle_ping(self, params):
         # Respond to server PING messages
-        self.send_data(f"PONG {resp.split()[1]}\r\n")
-
-    def process_user_list(self, line):
-        # Process the user list from the server
-        user_list = line.split(':')[-1].strip().split()
-        for username in user_list:
-            self.users.add_user(username)
-
-    def handle_user_join(self, line):
-        # Handle a user joining the channel
-        username = line.split('!')[0][1:]
-        self.users.add_user(username)
-        self.send_data(f"NAMES {self.channel}\r\n")
-
-    def handle_user_leave(self, line):
-        # Handle a user leaving the channel
-        username = line.split('!')[0][1:]
-        self.users.remove_user(username)
-
-    def handle_nick_change(self, line):
-        # Handle a user changing their nickname
-        old_username = line.split('!')[0][1:]
-        new_username = line.split(':')[-1].strip()
-        self.users.change_username(old_username, new_username)
-
-    def proccess_privmsg(self, resp):
+        self.send_data(f"PONG :{params[0] if params else self.host}\r\n")
+
+    def process_user_list(self, channel, names):
+        # Collect one chunk of a NAMES reply, the list is applied at 366
+        if channel in self.channels:
+            pending = self.names_pending.setdefault(channel, set())
+            pending.update(name.lstrip("@+") for name in names.split())
+
+    def end_user_list(self, channel):
+        # Replace the channel's users with the complete NAMES list
+        self.names_requested.discard(channel)
+        names = self.names_pending.pop(channel, None)
+        users = self.channels.get(channel)
+        if users is not None and names is not None:
+            users.sync(names)
+
+    def resync(self, channel):
+        # Ask for NAMES once when our view of a channel has drifted from the server's
+        if channel in self.channels and channel not in self.names_requested:
+            self.names_requested.add(channel)
+            self.send_data(f"NAMES {channel}\r\n")
+
+    def handle_user_join(self, channel, username):
+        # Handle a user joining a channel
+        if username == self.nick:
+            # The server sends NAMES after our own JOIN
+            self.channels.setdefault(channel, Users()).add_user(username)
+            return
+        users = self.channels.get(channel)
+        if users is not None:
+            users.add_user(username)
+
+    def handle_user_leave(self, channel, username):
+        # Handle a user leaving or being kicked from a channel
+        if username == self.nick:
+            self.channels.pop(channel, None)
+            self.names_pending.pop(channel, None)
+            self.names_requested.discard(channel)
+            return
+        users = self.channels.get(channel)
+        if users is not None:
+            if users.has_user(username):
+                users.remove_user(username)
+            else:
+                self.resync(channel)
+
+    def handle_user_quit(self, username, params):
+        # Handle a user quitting, they leave every channel we share
+        for users in self.channels.values():
+            users.remove_user(username)
+
+    def handle_nick_change(self, old_username, new_username):
+        # Handle a user changing their nickname, '*' is our own nick before registration
+        if old_username in ("*", self.nick):
+            self.nick = new_username
+            if old_username == "*":
+                return
+        known = False
+        for channel, users in self.channels.items():
+            if not users.has_user(old_username):
+                continue
+            known = True
+            if not users.change_username(old_username, new_username):
+                # The new nick is already listed, so this list is stale
+                users.remove_user(old_username)
+                self.resync(channel)
+        if not known:
+            # The server only relays NICK to users sharing a channel with us, so a list is missing them
+            for channel in self.channels:
+                self.resync(channel)
+
+    def part_channel(self, channel, reason):
+        # Leave a channel and quit once no channels are left
+        self.handle_user_leave(channel, self.nick)
+        # The server answers with its own spelling of the name, so compare the way it does
+        key = channel_key(channel)
+        self.wanted_channels = [c for c in self.wanted_channels if channel_key(c) != key]
+        self.send_data(f"PART {channel} :{reason}\r\n")
+        if not self.wanted_channels:
+            self.quit("Bot is shutting down")
+
+    def proccess_privmsg(self, username, target, msg):
         # Process private messages
-        parts = resp.split(' ', 3)
-        username = parts[0].split('!')[0][1:]
-        target = parts[2]
-        msg = parts[3][1:]
 
         # Handle different types of messages
         if target == self.nick:
             fact = self.getFunFacts()
             self.send_data(f"PRIVMSG {username} :{fact}\r\n")
-        elif "!" in msg:
-            if "!hello" in msg:
-                self.send_data(f"PRIVMSG {self.channel} :Hello {username}!\r\n")
-            elif "!slap" in msg:
-                return self.handle_slap(username, msg)
-            elif "!roulette" in msg:
-                self.handle_roulette(username, msg)
-            elif "!work" in msg:
-                self.handle_work(username)
-            elif "!bal" in msg:
-                self.handle_bal(username, msg)
-            else:
-                cmds = self.show_commands()
-                for cmd in cmds.split('\n'):
-                    self.send_data(f"PRIVMSG {self.channel} :{cmd}\r\n")
-        return False
+        elif target not in self.channels:
+            return
+        elif msg.startswith("!"):
+            users = self.channels[target]
+            if not users.has_user(username):
+                # Someone we did not see join is talking, our list is out of date
+                users.add_user(username)
+                self.resync(target)
+            self.commands.dispatch(self, target, username, msg)
+
+    def handle_hello(self, channel, username, args):
+        # Handle the hello command
+        self.send_data(f"PRIVMSG {channel} :Hello {username}!\r\n")
 
-    def handle_slap(self, username, msg):
+    def handle_help(self, channel, username, args):
+        # Show the command list
+        cmds = self.show_commands()
+        for cmd in cmds.split('\n'):
+            self.send_data(f"PRIVMSG {channel} :{cmd}\r\n")
+
+    def handle_slap(self, channel, username, args):
         # Handle the slap command
-        parts = msg.split()
-        if len(parts) == 2:
-            victim = parts[1]
+        users = self.channels[channel]
+        if len(args) == 1:
+            victim = args[0]
             if victim == self.nick:
-                user = self.users.get_user(username)
+                user = users.get_user(username)
                 user.slap_count += 1
                 if user.slap_count == 1:
-                    self.send_data(f"PRIVMSG {self.channel} :Really, {username}? You had the nerve to slap me? Fine, but don't push your luck!\r\n")
+                    self.send_data(f"PRIVMSG {channel} :Really, {username}? You had the nerve to slap me? Fine, but don't push your luck!\r\n")
                 elif user.slap_count == 2:
-                    self.send_data(f"PRIVMSG {self.channel} :That's it, {username}! I'm furious! One more slap and you'll regret it! Consider yourself warned!\r\n")
+                    self.send_data(f"PRIVMSG {channel} :That's it, {username}! I'm furious! One more slap and you'll regret it! Consider yourself warned!\r\n")
                 else:
-                    self.send_data(f"KICK {self.channel} {username} :That's it! I've warned you enough, {username}! You crossed the line, and now you're out!\r\n")
+                    self.send_data(f"KICK {channel} {username} :That's it! I've warned you enough, {username}! You crossed the line, and now you're out!\r\n")
                     user.slap_count = 0
-                self.users.update_user(username, slapped=True)
+                users.update_user(username, slapped=True)
                 # Check if all users have slapped the bot
-                if all(self.users.get_user(u).slapped for u in self.users.get_all_users() if u != self.nick):
-                    self.send_data(f"PRIVMSG {self.channel} :Seriously?! Every single one of you? After everything I've done for this channel, this is how you treat me?\r\n")
-                    self.send_data(f"PART {self.channel} :Fine! I'm leaving. Clearly, no one cares about me here. Goodbye forever. :'-( \r\n")
-                    return True  # Signal to main loop to exit
-            elif victim in self.users.get_all_users():
-                self.send_data(f"PRIVMSG {self.channel} :*slaps {victim} with a trout*\r\n")
+                others = len(users.users) - (1 if users.has_user(self.nick) else 0)
+                if users.slapped_count >= others:
+                    self.send_data(f"PRIVMSG {channel} :Seriously?! Every single one of you? After everything I've done for this channel, this is how you treat me?\r\n")
+                    self.part_channel(channel, "Fine! I'm leaving. Clearly, no one cares about me here. Goodbye forever. :'-( ")
+            elif users.has_user(victim):
+                self.send_data(f"PRIVMSG {channel} :*slaps {victim} with a trout*\r\n")
             else:
-                self.send_data(f"PRIVMSG {self.channel} :Can't slap {victim}, they're not here.\r\n")
+                self.send_data(f"PRIVMSG {channel} :Can't slap {victim}, they're not here.\r\n")
         else:
             # Slap a random user if no specific victim
-            victims = list(self.users.get_all_users())
-            victims.remove(self.nick)
-            victims.remove(username)
-            if len(victims) > 0:
-                victim = random.choice(victims)
-                self.send_data(f"PRIVMSG {self.channel} :*slaps {victim} with a trout*\r\n")
+            victim = users.random_user((self.nick, username))
+            if victim is not None:
+                self.send_data(f"PRIVMSG {channel} :*slaps {victim} with a trout*\r\n")
             else:
-                self.send_data(f"PRIVMSG {self.channel} :No one to slap :(\r\n")
-        return False  # Continue normal operation
+                self.send_data(f"PRIVMSG {channel} :No one to slap :(\r\n")
 
-    def handle_roulette(self, username, msg):
+    def handle_roulette(self, channel, username, args):
         # Handle the roulette command
-        parts = msg.split()
-        if len(parts) == 3:
-            amt_str = parts[1]
-            bet = parts[2]
-                        
+        if len(args) == 2:
+            amt_str = args[0]
+            bet = args[1]
+
             if amt_str.isdigit() and int(amt_str) > 0:
                 amt = int(amt_str)
-                bal = self.get_bal(username)
-                            
+                bal = self.get_bal(channel, username)
+
                 if amt > bal:
-                    self.send_data(f"PRIVMSG {self.channel} :Sorry {username}, you only have ${bal}. Can't bet ${amt}.\r\n")
+                    self.send_data(f"PRIVMSG {channel} :Sorry {username}, you only have ${bal}. Can't bet ${amt}.\r\n")
+                    return False
                 else:
-                    self.send_data(f"PRIVMSG {self.channel} :Spinning the wheel...\r\n")
-                    time.sleep(4)
-                    result, color, win, winnings = self.roulette.play(amt, bet)
-                    self.send_data(f"PRIVMSG {self.channel} :It's {result} {color}!\r\n")
-                                
-                    if win:
-                        self.update_bal(username, winnings - amt)
-                        self.send_data(f"PRIVMSG {self.channel} :Congrats {username}! You won ${winnings}!\r\n")
-                    else:
-                        self.update_bal(username, -amt)
-                        self.send_data(f"PRIVMSG {self.channel} :Tough luck {username}. You lost ${amt}.\r\n")
-                                
-                    new_bal = self.get_bal(username)
-                    self.send_data(f"PRIVMSG {self.channel} :{username}, your balance: ${new_bal}.\r\n")
+                    # Take the stake now so bets placed during the spin see the lower balance
+                    self.update_bal(channel, username, -amt)
+                    self.send_data(f"PRIVMSG {channel} :Spinning the wheel...\r\n")
+                    # Finish the spin later so the other channels keep running
+                    self.call_later(4, lambda: self.finish_roulette(channel, username, amt, bet))
             else:
-                self.send_data(f"PRIVMSG {self.channel} :Invalid bet. Use a positive number.\r\n")
+                self.send_data(f"PRIVMSG {channel} :Invalid bet. Use a positive number.\r\n")
+                return False
         else:
-            self.send_data(f"PRIVMSG {self.channel} :Wrong format. Use: !roulette <amount> <bet>\r\n")
-            self.send_data(f"PRIVMSG {self.channel} :Bets: red/black, odd/even, 1-12/13-24/25-36, 1-18/19-36, or 0-36\r\n")
+            self.send_data(f"PRIVMSG {channel} :Wrong format. Use: !roulette <amount> <bet>\r\n")
+            self.send_data(f"PRIVMSG {channel} :Bets: red/black, odd/even, 1-12/13-24/25-36, 1-18/19-36, or 0-36\r\n")
+            return False
+
+    def finish_roulette(self, channel, username, amt, bet):
+        # Announce the result of a roulette spin, the stake was already taken
+        if channel not in self.channels:
+            return
+        result, color, win, winnings = self.roulette.play(amt, bet, self.roulette.stream(channel))
+        self.send_data(f"PRIVMSG {channel} :It's {result} {color}!\r\n")
 
-    def handle_work(self, username):
+        if win:
+            self.update_bal(channel, username, winnings)
+            self.send_data(f"PRIVMSG {channel} :Congrats {username}! You won ${winnings}!\r\n")
+        else:
+            self.send_data(f"PRIVMSG {channel} :Tough luck {username}. You lost ${amt}.\r\n")
+
+        new_bal = self.get_bal(channel, username)
+        self.send_data(f"PRIVMSG {channel} :{username}, your balance: ${new_bal}.\r\n")
+
+    def handle_work(self, channel, username, args):
         # Handle the work command
         pay = random.randint(100, 900)
-        self.update_bal(username, pay)
-        new_bal = self.get_bal(username)
-        self.send_data(f"PRIVMSG {self.channel} :{username}, worked hard and got ${pay}!\r\n")
-        self.send_data(f"PRIVMSG {self.channel} :{username}, Your balance: ${new_bal}.\r\n")
+        self.update_bal(channel, username, pay)
+        new_bal = self.get_bal(channel, username)
+        self.send_data(f"PRIVMSG {channel} :{username}, worked hard and got ${pay}!\r\n")
+        self.send_data(f"PRIVMSG {channel} :{username}, Your balance: ${new_bal}.\r\n")
 
-    def handle_bal(self, username, msg):
+    def handle_bal(self, channel, username, args):
         # Handle the balance check command
-        parts = msg.split()
-        if len(parts) == 1:
-            bal = self.get_bal(username)
-            self.send_data(f"PRIVMSG {self.channel} :{username}, Your balance: ${bal}.\r\n")
-        elif len(parts) == 2 and parts[1] == "-lb":
-            leaderboard = self.users.get_leaderboard()
-            self.send_data(f"PRIVMSG {self.channel} :Leaderboard:\r\n")
+        if len(args) == 0:
+            bal = self.get_bal(channel, username)
+            self.send_data(f"PRIVMSG {channel} :{username}, Your balance: ${bal}.\r\n")
+        elif len(args) == 1 and args[0] == "-lb":
+            leaderboard = self.channels[channel].get_leaderboard()
+            self.send_data(f"PRIVMSG {channel} :Leaderboard:\r\n")
             for i, user in enumerate(leaderboard[:10], 1):
-                self.send_data(f"PRIVMSG {self.channel} :{i}. {user.username}: ${user.balance}\r\n")
+                self.send_data(f"PRIVMSG {channel} :{i}. {user.username}: ${user.balance}\r\n")
         else:
-            self.send_data(f"PRIVMSG {self.channel} :Invalid command. Use !bal or !bal -lb\r\n")
+            self.send_data(f"PRIVMSG {channel} :Invalid command. Use !bal or !bal -lb\r\n")
+
+    def is_admin(self, username):
+        # The server has no nick registration, so anyone can take a bare admin nick.
+        # A nick!user@host entry only matches when the whole prefix of the sender does.
+        return username in self.admins or self.sender in self.admins
+
+    def handle_trace(self, channel, username, args):
+        # Show command latencies, or start and stop the profiler with "!trace profile"
+        if not self.is_admin(username):
+            self.send_data(f"PRIVMSG {channel} :Sorry {username}, only bot admins can use !trace.\r\n")
+            return
+        tracer = self.commands.tracer
+        if args and args[0] == "profile":
+            if tracer.profiling:
+                count = tracer.stop_profile()
+                self.send_data(f"PRIVMSG {channel} :Profiler wrote {count} samples to {tracer.profile_file}\r\n")
+            else:
+                tracer.start_profile()
+                self.send_data(f"PRIVMSG {channel} :Profiler started, use !trace profile again to write it.\r\n")
+            return
+        for line in tracer.report() or ["No commands traced yet."]:
+            self.send_data(f"PRIVMSG {channel} :{line}\r\n")
 
     def handle_nick_error(self):
-        # Handle nickname errors and ask for a new one
-        while True:
+        # Handle nickname errors, ask for a new one or pick one when running unattended
+        if self.interactive:
             new_nick = input("Nickname is already in use. Please enter a new nickname for bot: ")
-            self.send_data(f"NICK {new_nick}\r\n")
-            
-            # Wait for server response
-            while True:
-                resp = self.receive_data()
-                if "433" in resp or "432" in resp:  # Nickname is still in use or erroneous
-                    print(f"Nickname '{new_nick}' is invalid or already in use. Please try again.")
-                    break
-                else: 
-                    self.nick = new_nick
-                    return
-    
+        else:
+            self.nick_attempts += 1
+            if self.nick_attempts > MAX_NICK_ATTEMPTS:
+                print(f"Error: No free nickname after {MAX_NICK_ATTEMPTS} tries, giving up.")
+                self.close()
+                return
+            # Numbered nicks, cut so they stay within the server's 9 character limit
+            suffix = str(self.nick_attempts)
+            new_nick = self.base_nick[:9 - len(suffix)] + suffix
+        print(f"Nickname '{self.nick}' is invalid or already in use, trying '{new_nick}'.")
+        self.nick = new_nick
+        self.send_data(f"NICK {new_nick}\r\n")
+
     def run(self):
-        # Main function to run the IRC bot
+        # Main function to run the IRC bot on its own
+        runtime = BotRuntime()
+        if runtime.add_bot(self):
+            runtime.run()
+
+def default_commands(plugin_dir=PLUGIN_DIR, tracer=None):
+    # Build a registry with the built-in commands and any plugins found in plugin_dir
+    commands = CommandRegistry(plugin_dir, tracer)
+    commands.register("hello", Bot.handle_hello)
+    commands.register("help", Bot.handle_help)
+    commands.register("slap", Bot.handle_slap, max_args=1, usage="!slap <user>")
+    commands.register("roulette", Bot.handle_roulette, cooldown=4)
+    commands.register("work", Bot.handle_work, cooldown=10)
+    commands.register("bal", Bot.handle_bal)
+    if tracer:
+        commands.register("trace", Bot.handle_trace, max_args=1, usage="!trace [profile]")
+    # Unknown commands show the help
+    commands.fallback = Bot.handle_help
+    return commands
+
+# BotRuntime class to run many connections and channels in one selectors loop
+class BotRuntime:
+    def __init__(self, tracer=None):
+        # tracer times every command when set, SIGUSR1 toggles the profiler either way
+        self.tracer = tracer
+        self.profiler = tracer or Tracer()
+        self.selector = selectors.DefaultSelector()
+        self.bots = []
+        # Heap of (when, sequence, callback) for delayed work like roulette spins
+        self.timers = []
+        self.timer_seq = 0
+        # Shared by every bot created through this runtime
+        self.roulette = Roulette()
+        self.facts = FunFacts()
+        self.commands = default_commands(tracer=tracer)
+
+    def create_bot(self, host, port, channels, nick, rate=2.0, burst=5, admins=(), interactive=False):
+        # Create and connect a bot that shares this runtime's roulette, fun facts and commands
+        bot = Bot(host, port, channels, nick, rate, burst, self.roulette, self.facts, interactive, self.commands, admins)
+        return bot if self.add_bot(bot) else None
+
+    def add_bot(self, bot):
+        # Connect a bot and start watching its socket
         try:
-            # Connect to the IRC server
-            self.irc.connect((self.host, self.port))
-        except Exception as e:
-            print(f"Error: Failed to connect to {self.host}:{self.port}. {str(e)}")
-            return
+            bot.connect()
+        except OSError as e:
+            print(f"Error: Failed to connect to {bot.host}:{bot.port}. {str(e)}")
+            return False
+        bot.runtime = self
+        self.bots.append(bot)
+        self.selector.register(bot.irc, selectors.EVENT_READ, bot)
+        return True
 
-        # Send initial NICK command
-        self.send_data(f"NICK {self.nick}\r\n")
+    def remove_bot(self, bot):
+        # Stop watching a bot whose connection has closed
+        if bot in self.bots:
+            self.bots.remove(bot)
+            self.selector.unregister(bot.irc)
+
+    def call_later(self, delay, callback):
+        # Schedule callback to run after delay seconds
+        self.timer_seq += 1
+        heapq.heappush(self.timers, (time.monotonic() + delay, self.timer_seq, callback))
+
+    def run_timers(self, now):
+        # Run every timer that is due, returns seconds until the next one or None
+        while self.timers and self.timers[0][0] <= now:
+            _, _, callback = heapq.heappop(self.timers)
+            try:
+                callback()
+            except Exception as e:
+                print(f"An error occurred: {e}")
+        return self.timers[0][0] - now if self.timers else None
+
+    def flush(self, now):
+        # Write queued lines for every bot, returns seconds until the next send or None
+        wait = None
+        for bot in list(self.bots):
+            bot_wait = bot.flush(now)
+            if bot.connected:
+                events = selectors.EVENT_READ | (selectors.EVENT_WRITE if bot.outbuf else 0)
+                self.selector.modify(bot.irc, events, bot)
+            if bot_wait is not None and (wait is None or bot_wait < wait):
+                wait = bot_wait
+        return wait
 
-        nick_accepted = False
+    def run_once(self, timeout=None):
+        # Run one pass of the event loop
+        now = time.monotonic()
+        waits = [w for w in (self.run_timers(now), self.flush(now)) if w is not None]
+        if timeout is not None:
+            waits.append(timeout)
+        if not self.bots:
+            return
+        for key, mask in self.selector.select(min(waits) if waits else None):
+            bot = key.data
+            if mask & selectors.EVENT_READ:
+                bot.on_readable()
+            if mask & selectors.EVENT_WRITE and bot.connected:
+                bot.flush(time.monotonic())
+
+    def run(self):
+        # Run until every connection has closed
+        self.profiler.install_signal_handler()
         try:
-            while self.running:
-                try:
-                    resp = self.receive_data()
-                    if not resp:
-                        print("Connection closed by the server.")
-                        break
-
-                    if resp.startswith("PING"):
-                        self.handle_ping(resp)
-
-                    if "PRIVMSG" in resp:
-                        if self.proccess_privmsg(resp):
-                            break  # Exit if the bot was slapped by everyone
-                    else:
-                        lines = resp.splitlines()
-                        for line in lines:
-                            if "433" in line or "432" in line:  # Nickname is already in use or erroneous
-                                self.handle_nick_error()
-                            elif not nick_accepted and "001" not in line:
-                                self.send_data(f"USER {self.nick} 0 * :{self.nick}\r\n")
-                                nick_accepted = True
-                            elif "001" in line:  # Welcome message, we're connected
-                                self.send_data(f"JOIN {self.channel}\r\n")
-                            elif "JOIN" in line:
-                                self.handle_user_join(line)
-                            elif "PART" in line or "QUIT" in line:
-                                self.handle_user_leave(line)
-                                self.send_data(f"NAMES {self.channel}\r\n")
-                            elif "353" in line and self.channel in line:  # NAMES reply
-                                self.process_user_list(line)
-                            elif "NICK" in line:
-                                self.handle_nick_change(line)
-                                self.send_data(f"NAMES {self.channel}\r\n")
-
-                except socket.error as e:
-                    print(f"Socket error occurred: {e}")
-                    break
-                except Exception as e:
-                    print(f"An error occurred: {e}")
-                    break
+            while self.bots:
+                self.run_once()
         except KeyboardInterrupt:
             print("\nBot is shutting down...")
         finally:
-            self.send_data(f"QUIT :Bot is shutting down\r\n")
-            self.irc.close()  # Ensuring the socket is closed when exiting
-            print("Connection closed.")
+            self.shutdown()
+
+    def shutdown(self, timeout=5.0):
+        # Send QUIT on every connection and give the queues a few seconds to drain
+        for bot in list(self.bots):
+            bot.quit("Bot is shutting down")
+        deadline = time.monotonic() + timeout
+        try:
+            while self.bots and time.monotonic() < deadline:
+                self.run_once(deadline - time.monotonic())
+        except KeyboardInterrupt:
+            pass
+        for bot in list(self.bots):
+            bot.close()
+        print("Connection closed.")
+
+def parse_server(value):
+    # Parse "host:port" or "[v6addr]:port" into (host, port)
+    host, _, port = value.rpartition(":")
+    if not host or not port.isdigit():
+        raise argparse.ArgumentTypeError(f"expected host:port, got {value}")
+    return host.strip("[]"), int(port)
 
 def parse_arguments():
     # Parse command-line arguments
     parser = argparse.ArgumentParser(description="IRC Bot")
     parser.add_argument("--host", default="::", help="Server to connect to")
     parser.add_argument("--port", type=int, default=6667, help="Port to connect to")
+    parser.add_argument("--server", type=parse_server, action="append", help="Extra host:port to connect to, may be repeated")
     parser.add_argument("--name", default="CoolBot", help="Nickname for the bot")
-    parser.add_argument("--channel", default="#test", help="Channel to join")
+    parser.add_argument("--channel", default="#test", help="Channel to join, or a comma separated list")
+    parser.add_argument("--rate", type=float, default=2.0, help="Outbound lines per second")
+    parser.add_argument("--burst", type=int, default=5, help="Lines that may be sent back to back")
+    parser.add_argument("--admin", action="append", default=[], help="Nick or nick!user@host allowed to use admin commands, may be repeated. "
+                        "A bare nick is not safe on servers without nick registration, anyone can take it")
+    parser.add_argument("--trace", action="store_true", help="Time every command, see !trace")
+    parser.add_argument("--profile-file", default="bot-profile.folded", help="Where the sampling profiler writes stacks")
     return parser.parse_args()
 
 def main():
     # Main entry point for the bot
     args = parse_arguments()
-    bot = Bot(args.host, args.port, args.channel, args.name)
-    bot.run()
+    tracer = Tracer(args.profile_file) if args.trace else None
+    runtime = BotRuntime(tracer)
+    runtime.profiler.profile_file = args.profile_file
+    servers = [(args.host, args.port)] + (args.server or [])
+    for host, port in servers:
+        # Only ask for a new nick on the terminal when there is a single connection
+        runtime.create_bot(host, port, args.channel, args.name, args.rate, args.burst, args.admin, len(servers) == 1)
+    runtime.run()
 
 if __name__ == "__main__":
     main()
@@ -1,25 +1,72 @@
+import time
+from client import server_time
+
+# RFC 1459 casemapping, where []\~ are the upper case forms of {}|^
+# Built once, channel_key runs on every channel command
+RFC1459_LOWER = str.maketrans("[]\\~", "{}|^")
+
+# Map a channel name to its case-insensitive key
+def channel_key(name):
+    return name.lower().translate(RFC1459_LOWER)
+
+# Encode and time stamp a message once, then send it to every client except the sender
+def send_to_clients(clients, message, sender=None, time=None):
+    plain = (message + "\r\n").encode('utf-8')
+    tagged = (f"@time={time or server_time()} {message}\r\n").encode('utf-8')
+    for client in clients:
+        if client != sender:
+            try:
+                client.send_data(tagged if "server-time" in client.caps else plain)
+            # ConnectionError is for connection-related issues
+            # BrokenPipeError is for trying to write on a socket which has been shutdown for writing
+            except(ConnectionError, BrokenPipeError):
+                print(f"Error: {client.nickname} has disconnected")
+
+# Channel and server sends go through send, trace_sends swaps in a timed wrapper
+send = send_to_clients
+
+def trace_sends(tracer=None):
+    # Time every send with tracer, or go back to the plain function when tracer is None
+    global send
+    send = tracer.wrap("send_to_clients", send_to_clients) if tracer else send_to_clients
+
+# Per-member data, slots keep it small in channels with many members
+class Membership:
+    __slots__ = ("modes", "joined_at")
+
+    def __init__(self, modes="", joined_at=None):
+        # modes holds member mode letters, "o" for channel operator
+        self.modes = modes
+        self.joined_at = joined_at if joined_at is not None else time.time()
+
 class Channel:
     def __init__(self, name):
         self.name = name
-        self.clients = set()
+        # Client -> Membership
+        self.clients = {}
 
-    def add_client(self, client):
-        self.clients.add(client)
+    def add_client(self, client, modes=None, joined_at=None):
+        if client not in self.clients:
+            # The first member of a new channel becomes its operator
+            if modes is None:
+                modes = "" if self.clients else "o"
+            self.clients[client] = Membership(modes, joined_at)
 
     def remove_client(self, client):
         if client in self.clients:
-            self.clients.remove(client)
+            del self.clients[client]
+
+    def is_empty(self):
+        return not self.clients
+
+    # Nickname with its NAMES prefix, "@" for operators
+    def display_name(self, client):
+        return ("@" if "o" in self.clients[client].modes else "") + client.nickname
         
     # Broadcast a message to all clients in the channel except the sender
-    def broadcast(self, message, sender=None):
-        for client in self.clients:
-            if client != sender:
-                try:
-                    client.send_message(message)
-                # ConnectionError is for connection-related issues
-                # BrokenPipeError is for trying to write on a socket which has been shutdown for writing
-                except(ConnectionError, BrokenPipeError):
-                    print(f"Error: {client.nickname} has disconnected")
+    # The line is encoded and time stamped once, not once per client
+    def broadcast(self, message, sender=None, time=None):
+        send(self.clients, message, sender, time)
 
     #Set is not subscriptable, rmbr to add call to this function
     def display_clients(self):
@@ -1,5 +1,9 @@
 import datetime
 
+# Current time in the IRCv3 server-time format
+def server_time():
+    return datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+
 class Client:
     # Initialize the client
     def __init__(self, socket, address):
@@ -11,11 +15,23 @@ class Client:
         self.last_activity = datetime.datetime.now()
         self.ping_sent = False
         self.ping_sent_time = None
+        # IRCv3 capabilities enabled with CAP REQ
+        self.caps = set()
+        # Registration waits for CAP END while capabilities are being negotiated
+        self.cap_negotiating = False
+        self.user_pending = False
+        self.registered = False
+
+    # Send a message to the client, stamped with time if it asked for server-time
+    def send_message(self, message, time=None):
+        if time and "server-time" in self.caps:
+            message = f"@time={time} {message}"
+        self.send_data((message + "\r\n").encode('utf-8'))
 
-    # Send a message to the client
-    def send_message(self, message):
+    # Send an already encoded line to the client
+    def send_data(self, data):
         try: 
-            self.socket.send((message + "\r\n").encode('utf-8'))
+            self.socket.send(data)
         # ConnectionError is for connection-related issues
         # BrokenPipeError is for trying to write on a socket which has been shutdown for writing
         except(ConnectionError, BrokenPipeError):
@@ -30,3 +46,34 @@ class Client:
         if channel in self.channels:
             self.channels.remove(channel)
             channel.remove_client(self)
+
+    # Save the client's state for a graceful restart, the socket is passed separately
+    def to_state(self):
+        return {
+            "address": list(self.address),
+            "nickname": self.nickname,
+            "buffer": self.buffer,
+            "last_activity": self.last_activity.timestamp(),
+            "ping_sent": self.ping_sent,
+            "ping_sent_time": self.ping_sent_time.timestamp() if self.ping_sent_time else None,
+            "caps": sorted(self.caps),
+            "cap_negotiating": self.cap_negotiating,
+            "user_pending": self.user_pending,
+            "registered": self.registered,
+        }
+
+    # Rebuild a client from to_state() output, channels are rejoined by the server
+    @classmethod
+    def from_state(cls, socket, state):
+        client = cls(socket, tuple(state["address"]))
+        client.nickname = state["nickname"]
+        client.buffer = state["buffer"]
+        client.last_activity = datetime.datetime.fromtimestamp(state["last_activity"])
+        client.ping_sent = state["ping_sent"]
+        if state["ping_sent_time"] is not None:
+            client.ping_sent_time = datetime.datetime.fromtimestamp(state["ping_sent_time"])
+        client.caps = set(state["caps"])
+        client.cap_negotiating = state["cap_negotiating"]
+        client.user_pending = state["user_pending"]
+        client.registered = state["registered"]
+        return client
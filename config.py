@@ -0,0 +1,54 @@
+# Server configuration, read from an INI file with a [server] section
+import configparser
+
+# Used for anything the file leaves out
+DEFAULTS = {
+    # Comma separated host:port pairs, IPv6 hosts may be written as [host]:port
+    "listen": "::1:6667",
+    "backlog": "5",
+    # Seconds of silence before we PING a client, and before an unanswered PING drops it
+    "ping_interval": "60",
+    "ping_timeout": "60",
+    # 0 means no limit
+    "max_clients": "0",
+    "log_file": "log.txt",
+    # Time every command handler, SIGUSR1 toggles the sampling profiler either way
+    "trace": "false",
+    "profile_file": "profile.folded",
+    "profile_interval": "0.005",
+}
+
+def parse_listen(value):
+    # Parse "host:port, [v6addr]:port" into a list of (host, port)
+    addresses = []
+    for item in value.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        host, _, port = item.rpartition(":")
+        if not host or not port.isdigit():
+            raise ValueError(f"listen address must be host:port, got {item}")
+        addresses.append((host.strip("[]"), int(port)))
+    if not addresses:
+        raise ValueError("at least one listen address is needed")
+    return addresses
+
+def load_config(path=None):
+    # Load the config file at path on top of the defaults
+    parser = configparser.ConfigParser()
+    parser.read_dict({"server": DEFAULTS})
+    if path:
+        with open(path) as f:
+            parser.read_file(f)
+    section = parser["server"]
+    return {
+        "listen": parse_listen(section["listen"]),
+        "backlog": section.getint("backlog"),
+        "ping_interval": section.getfloat("ping_interval"),
+        "ping_timeout": section.getfloat("ping_timeout"),
+        "max_clients": section.getint("max_clients"),
+        "log_file": section["log_file"],
+        "trace": section.getboolean("trace"),
+        "profile_file": section["profile_file"],
+        "profile_interval": section.getfloat("profile_interval"),
+    }
@@ -0,0 +1,38 @@
+# Hand listening and client sockets to a new server process over a Unix socket
+import json
+import socket
+import struct
+
+# The kernel limits how many descriptors one message can carry
+FDS_PER_MESSAGE = 200
+# Seconds either side waits for the other during a handoff
+TIMEOUT = 10
+
+def send_state(conn, state, fds):
+    # Send the JSON state, then the descriptors with SCM_RIGHTS in batches
+    data = json.dumps(state).encode("utf-8")
+    conn.sendall(struct.pack("!II", len(data), len(fds)) + data)
+    for i in range(0, len(fds), FDS_PER_MESSAGE):
+        socket.send_fds(conn, [b"F"], fds[i:i + FDS_PER_MESSAGE])
+
+def receive_state(conn):
+    # Receive what send_state sent, returns (state, fds)
+    size, count = struct.unpack("!II", recv_exactly(conn, 8))
+    state = json.loads(recv_exactly(conn, size).decode("utf-8"))
+    fds = []
+    while len(fds) < count:
+        data, batch, _, _ = socket.recv_fds(conn, 1, FDS_PER_MESSAGE)
+        if not data:
+            raise ConnectionError("handoff closed before every socket arrived")
+        fds.extend(batch)
+    return state, fds
+
+def recv_exactly(conn, size):
+    # Read exactly size bytes
+    data = b""
+    while len(data) < size:
+        chunk = conn.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("handoff closed early")
+        data += chunk
+    return data
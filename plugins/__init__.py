@@ -0,0 +1,5 @@
+# Bot command plugins, each module <name>.py adds the !<name> command
+# A plugin defines handle(bot, channel, username, args) and may set
+# COOLDOWN, MIN_ARGS, MAX_ARGS and USAGE. handle() may return False when it
+# rejects its arguments, then the cooldown does not start. Plugins are
+# imported the first time their command is used.
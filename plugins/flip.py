@@ -0,0 +1,10 @@
+# Flip a coin
+import random
+
+COOLDOWN = 2
+MAX_ARGS = 0
+USAGE = "!flip"
+
+def handle(bot, channel, username, args):
+    side = random.choice(["heads", "tails"])
+    bot.send_data(f"PRIVMSG {channel} :{username} flipped a coin: {side}!\r\n")
@@ -0,0 +1,113 @@
+# Batch roulette simulation for auditing the house edge and payouts
+# Needs NumPy, the bot itself does not
+import argparse
+import numpy as np
+from bot import Roulette
+
+# Every bet type the bot accepts
+BETS = ["red", "black", "odd", "even", "1-12", "13-24", "25-36", "1-18", "19-36"] + [str(n) for n in range(37)]
+
+# Spins are simulated in chunks so millions of spins use little memory
+CHUNK_SIZE = 1_000_000
+
+# SimulationResult class to hold the outcome of a batch of spins
+class SimulationResult:
+    def __init__(self, bet, amount, spins, payouts):
+        # payouts maps winnings per spin to how many spins paid that much
+        self.bet = bet
+        self.amount = amount
+        self.spins = spins
+        self.payouts = payouts
+        total = sum(winnings * count for winnings, count in payouts.items())
+        # Average net result per spin for the player
+        self.expected_value = total / spins - amount if spins else 0.0
+        self.house_edge = -self.expected_value / amount if amount else 0.0
+
+    def __repr__(self):
+        return (f"SimulationResult(bet={self.bet!r}, spins={self.spins}, "
+                f"expected_value={self.expected_value:.4f}, house_edge={self.house_edge:.4%})")
+
+# RouletteSimulator class to spin the wheel millions of times with lookup tables
+class RouletteSimulator:
+    def __init__(self, roulette=None):
+        # Build 37-entry lookup tables from the scalar wheel so both always agree
+        self.roulette = roulette or Roulette()
+        numbers = self.roulette.numbers
+        self.color = np.array(self.roulette.colors)
+        self.odd = np.array([self.roulette.is_odd(n) for n in numbers])
+        self.dozen = np.array([self.roulette.get_dozen(n) or "" for n in numbers])
+        self.range = np.array([self.roulette.get_range(n) or "" for n in numbers])
+        self.number = np.arange(len(numbers))
+
+    def payout_table(self, bet, amount=1):
+        # Winnings for each wheel number when betting amount on bet
+        if bet in ['red', 'black']:
+            win, multiplier = self.color == bet, 2
+        elif bet in ['odd', 'even']:
+            win, multiplier = self.odd if bet == 'odd' else ~self.odd, 2
+        elif bet in ['1-12', '13-24', '25-36']:
+            win, multiplier = self.dozen == bet, 3
+        elif bet in ['1-18', '19-36']:
+            win, multiplier = self.range == bet, 2
+        elif bet.isdigit():
+            win, multiplier = self.number == int(bet), 36
+        else:
+            win, multiplier = np.zeros(len(self.number), dtype=bool), 0
+        return np.where(win, amount * multiplier, 0)
+
+    def simulate(self, bet, spins, amount=1, seed=None):
+        # Spin the wheel spins times and collect the payout distribution
+        rng = np.random.default_rng(seed)
+        counts = np.zeros(len(self.number), dtype=np.int64)
+        remaining = spins
+        while remaining > 0:
+            size = min(remaining, CHUNK_SIZE)
+            results = rng.integers(0, len(self.number), size=size)
+            counts += np.bincount(results, minlength=len(self.number))
+            remaining -= size
+        table = self.payout_table(bet, amount)
+        payouts = {}
+        for winnings, count in zip(table.tolist(), counts.tolist()):
+            payouts[winnings] = payouts.get(winnings, 0) + count
+        return SimulationResult(bet, amount, spins, payouts)
+
+    def expected_value(self, bet, amount=1):
+        # Exact expected net result per spin, every number is equally likely
+        return float(self.payout_table(bet, amount).mean()) - amount
+
+    def verify_payouts(self, amount=1):
+        # Compare the lookup tables with Roulette.settle for every bet and number
+        # Returns a list of (bet, number, table winnings, scalar winnings) mismatches
+        mismatches = []
+        for bet in BETS:
+            table = self.payout_table(bet, amount)
+            for n in self.roulette.numbers:
+                _, _, winnings = self.roulette.settle(n, amount, bet)
+                if table[n] != winnings:
+                    mismatches.append((bet, n, int(table[n]), winnings))
+        return mismatches
+
+def parse_arguments():
+    # Parse command-line arguments
+    parser = argparse.ArgumentParser(description="Roulette payout audit")
+    parser.add_argument("--spins", type=int, default=1_000_000, help="Spins per bet type")
+    parser.add_argument("--amount", type=int, default=1, help="Amount staked per spin")
+    parser.add_argument("--seed", type=int, default=None, help="Seed for reproducible runs")
+    return parser.parse_args()
+
+def main():
+    args = parse_arguments()
+    simulator = RouletteSimulator()
+    mismatches = simulator.verify_payouts(args.amount)
+    if mismatches:
+        for bet, n, table, scalar in mismatches:
+            print(f"Mismatch: bet {bet} on {n} pays {table} in the table but {scalar} in play")
+        return
+    print("Payout tables match Roulette.play")
+    for bet in ["red", "black", "odd", "even", "1-12", "13-24", "25-36", "1-18", "19-36", "0", "17"]:
+        result = simulator.simulate(bet, args.spins, args.amount, args.seed)
+        exact = simulator.expected_value(bet, args.amount)
+        print(f"{bet:>6}: simulated EV {result.expected_value:+.4f}, exact EV {exact:+.4f}, house edge {result.house_edge:+.2%}")
+
+if __name__ == "__main__":
+    main()
@@ -4,18 +4,42 @@ import select
 import datetime
 import re
 import time
-from channel import Channel
-from client import Client
+import os
+import sys
+import signal
+import argparse
+import subprocess
+import configparser
+import itertools
+import handoff
+import channel as chan
+from channel import Channel, channel_key
+from client import Client, server_time
+from config import load_config
+from tracing import Tracer
+
+# IRCv3 capabilities this server can negotiate with CAP
+SUPPORTED_CAPS = ("batch", "echo-message", "server-time")
+# Batch type used to frame NAMES replies
+BATCH_NAMES = "miniirc/names"
 
 # Define Server class to manage the IRC server      
 class Server:
-    # Initialize the server
-    def __init__(self, host, port):
-        self.host = host
-        self.port = port
-        self.socket = socket.socket(socket.AF_INET6, socket.SOCK_STREAM)
+    # Initialize the server from a config dict, config_path is re-read on SIGHUP
+    def __init__(self, config, config_path=None):
+        self.config = config
+        self.config_path = config_path
+        self.host, self.port = config["listen"][0]
+        # (host, port) -> listening socket
+        self.listeners = {}
         self.clients = {}
+        # channel_key(name) -> Channel, so #Foo and #foo are the same channel
         self.channels = {}
+        self.running = True
+        self.reload_requested = False
+        self.restart_requested = False
+        # Reference tags for BATCH
+        self.batch_refs = itertools.count(1)
 
         # Define command handlers
         self.command_handlers = {
@@ -31,6 +55,35 @@ class Server:
             "PART": self.handle_part,
             "KICK": self.handle_kick,
         }
+
+        self.tracer = Tracer(config["profile_file"], config["profile_interval"])
+        self.tracing = False
+        if config["trace"]:
+            self.enable_tracing()
+
+    # Time every command handler and the helpers the main loop calls
+    # Handlers are only wrapped here, so tracing costs nothing while it is off
+    def enable_tracing(self):
+        if self.tracing:
+            return
+        self.tracing = True
+        for command, handler in self.command_handlers.items():
+            self.command_handlers[command] = self.tracer.wrap(command, handler)
+        self.check_inactive_clients = self.tracer.wrap("check_inactive_clients", self.check_inactive_clients)
+        self.handle_log = self.tracer.wrap("handle_log", self.handle_log)
+        # Channel sends are timed through the channel module, not by patching Channel
+        chan.trace_sends(self.tracer)
+
+    # Put back the plain handlers, the histograms are kept for the next report
+    def disable_tracing(self):
+        if not self.tracing:
+            return
+        self.tracing = False
+        for command, handler in self.command_handlers.items():
+            self.command_handlers[command] = handler.__wrapped__
+        del self.check_inactive_clients
+        del self.handle_log
+        chan.trace_sends(None)
     
     def handle_names(self, client, parts):
         if len(parts) < 2:
@@ -39,11 +92,22 @@ class Server:
             return
         
         channel_name = parts[1]
-        if channel_name in self.channels:
-            channel = self.channels[channel_name]
-            names = " ".join([c.nickname for c in channel.clients])
-            client.send_message(f":IRCserver 353 {client.nickname} = {channel_name} :{names}")
-            client.send_message(f":IRCserver 366 {client.nickname} {channel_name} :End of /NAMES list")
+        channel = self.get_channel(channel_name)
+        if channel:
+            # Split the names over as many 353 lines as needed to stay under 512 bytes
+            # Replies use the channel's own spelling, not the one the client typed
+            header = f":IRCserver 353 {client.nickname} = {channel.name} :"
+            lines = []
+            names = ""
+            for c in channel.clients:
+                name = channel.display_name(c)
+                if names and len(header) + len(names) + len(name) + 3 > 512:
+                    lines.append(header + names)
+                    names = ""
+                names = f"{names} {name}" if names else name
+            lines.append(header + names)
+            lines.append(f":IRCserver 366 {client.nickname} {channel.name} :End of /NAMES list")
+            self.send_batch(client, BATCH_NAMES, channel.name, lines)
         else:
             client.send_message(f":IRCserver 403 {client.nickname} {channel_name} :No such channel")
 
@@ -60,8 +124,8 @@ class Server:
         else:
             reason = "No reason given"
         
-        if channel_name in self.channels:
-            channel = self.channels[channel_name]
+        channel = self.get_channel(channel_name)
+        if channel:
             if client in channel.clients:
                 target_client = None
                 for c in channel.clients:
@@ -69,10 +133,11 @@ class Server:
                         target_client = c
                         break
                 if target_client:
-                    target_client.leave_channel(channel)
-                    channel.broadcast(f":{client.nickname}!{client.nickname}@{client.address[0]} KICK {channel_name} {target_nick} :{reason}")
-                    channel.remove_client(target_client)
-                    channel.display_clients()
+                    # Broadcast first so the kicked client sees its own KICK
+                    channel.broadcast(f":{client.nickname}!{client.nickname}@{client.address[0]} KICK {channel.name} {target_nick} :{reason}")
+                    self.leave_channel(target_client, channel)
+                    if not channel.is_empty():
+                        channel.display_clients()
                 else:
                     client.send_message(f":IRCserver 401 {client.nickname} {target_nick} :No such nick/channel")
             else:
@@ -92,50 +157,192 @@ class Server:
         else:
             reason = "Leaving"
         
-        if channel_name in self.channels:
-            channel = self.channels[channel_name]
+        channel = self.get_channel(channel_name)
+        if channel:
             if client in channel.clients:
-                channel.broadcast(f":{client.nickname}!{client.nickname}@{client.address[0]} PART {channel_name} :{reason}")
-                client.leave_channel(channel)
-                channel.remove_client(client)
-                channel.display_clients()
+                channel.broadcast(f":{client.nickname}!{client.nickname}@{client.address[0]} PART {channel.name} :{reason}")
+                self.leave_channel(client, channel)
+                if not channel.is_empty():
+                    channel.display_clients()
             else:
                 client.send_message(f":IRCserver 442 {client.nickname} {channel_name} :You're not on that channel")
         else:
             client.send_message(f":IRCserver 403 {client.nickname} {channel_name} :No such channel")
         
 
+    # Open a listening socket for every configured address that is not open yet
+    def open_listeners(self):
+        wanted = set(self.config["listen"])
+        for address in list(self.listeners):
+            if address not in wanted:
+                self.listeners.pop(address).close()
+                print("Stopped listening on", address)
+        for host, port in self.config["listen"]:
+            if (host, port) in self.listeners:
+                continue
+            family = socket.AF_INET6 if ":" in host else socket.AF_INET
+            sock = socket.socket(family, socket.SOCK_STREAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            try:
+                sock.bind((host, port, 0, 0) if family == socket.AF_INET6 else (host, port))
+                sock.listen(self.config["backlog"])
+            except OSError as e:
+                sock.close()
+                print(f"Error: Cannot listen on {host}:{port}. {e}")
+                continue
+            self.listeners[(host, port)] = sock
+            print("IRC Server running on port", port)
+
+    # Re-read the config file, keeping the old settings if it is broken
+    def reload_config(self):
+        try:
+            config = load_config(self.config_path)
+        except (OSError, ValueError, configparser.Error) as e:
+            print("Error: Config reload failed, keeping the current settings.", e)
+            return
+        self.config = config
+        self.host, self.port = config["listen"][0]
+        self.tracer.profile_file = config["profile_file"]
+        self.tracer.interval = config["profile_interval"]
+        if config["trace"]:
+            self.enable_tracing()
+        else:
+            self.disable_tracing()
+        self.open_listeners()
+        print("Config reloaded from", self.config_path)
+
+    # Install signal handlers, the main loop acts on the flags
+    def install_signal_handlers(self):
+        signal.signal(signal.SIGHUP, lambda signum, frame: setattr(self, "reload_requested", True))
+        signal.signal(signal.SIGUSR2, lambda signum, frame: setattr(self, "restart_requested", True))
+        self.tracer.install_signal_handler(signal.SIGUSR1)
+
     # Start the server and listen for connections
-    def start(self):
+    def start(self, takeover_fd=None):
         try:
-            self.socket.bind((self.host, self.port, 0, 0))
-            self.socket.listen(5)
-            print("IRC Server running on port", self.port)
-            
-            while True:
+            if takeover_fd is not None:
+                self.take_over(takeover_fd)
+            self.open_listeners()
+            if not self.listeners:
+                return
+            self.install_signal_handlers()
+
+            while self.running:
                 try:
                     # Use select to monitor the socket 
                     # Timeout is set to 1 second to regularly check for new clients
-                    readable, _, _ = select.select([self.socket] + list(self.clients.keys()), [], [], 1)
+                    listening = list(self.listeners.values())
+                    readable, _, _ = select.select(listening + list(self.clients.keys()), [], [], 1)
                     for sock in readable:
-                        if sock == self.socket:
-                            client_socket, address = self.socket.accept()
-                            client = Client(client_socket, address)
-                            self.clients[client_socket] = client
-                            print("New connection from", address)
-                        else:
+                        if sock in listening:
+                            self.accept_client(sock)
+                        elif sock in self.clients:
                             self.handle_client(self.clients[sock])
                     
                     # Check for inactive clients
                     self.check_inactive_clients()
 
+                    if self.reload_requested:
+                        self.reload_requested = False
+                        self.reload_config()
+                    if self.restart_requested:
+                        self.restart_requested = False
+                        self.restart()
+
                 # ConnectionError is for connection-related issues
                 # BrokenPipeError is for trying to write on a socket which has been shutdown for writing
                 except(ConnectionError, BrokenPipeError):
                     print("Error: A client has disconnected")
         except Exception as e:
             print("Error:", e)
-            
+
+    # Accept a new connection unless the server is full
+    def accept_client(self, listener):
+        client_socket, address = listener.accept()
+        max_clients = self.config["max_clients"]
+        if max_clients and len(self.clients) >= max_clients:
+            client_socket.send(b"ERROR :Server is full\r\n")
+            client_socket.close()
+            print("Refused connection from", address, "(server full)")
+            return
+        client = Client(client_socket, address)
+        self.clients[client_socket] = client
+        print("New connection from", address)
+
+    # Save clients and channels so a new process can carry on serving them
+    def serialize_state(self):
+        listeners = list(self.listeners.items())
+        clients = list(self.clients.values())
+        positions = {client: i for i, client in enumerate(clients)}
+        state = {
+            "listeners": [list(address) for address, _ in listeners],
+            "clients": [client.to_state() for client in clients],
+            # Members are [client position, modes, join time]
+            "channels": [
+                {"name": channel.name,
+                 "members": [[positions[c], m.modes, m.joined_at] for c, m in channel.clients.items()]}
+                for channel in self.channels.values()
+            ],
+        }
+        fds = [sock.fileno() for _, sock in listeners] + [client.socket.fileno() for client in clients]
+        return state, fds
+
+    # Rebuild the listeners, clients and channels handed over by the old process
+    def restore_state(self, state, fds):
+        listener_count = len(state["listeners"])
+        for address, fd in zip(state["listeners"], fds[:listener_count]):
+            self.listeners[tuple(address)] = socket.socket(fileno=fd)
+        clients = []
+        for client_state, fd in zip(state["clients"], fds[listener_count:]):
+            client = Client.from_state(socket.socket(fileno=fd), client_state)
+            self.clients[client.socket] = client
+            clients.append(client)
+        for channel_state in state["channels"]:
+            channel = Channel(channel_state["name"])
+            self.channels[channel_key(channel.name)] = channel
+            for position, modes, joined_at in channel_state["members"]:
+                channel.add_client(clients[position], modes, joined_at)
+                clients[position].channels.add(channel)
+
+    # Receive the old process's sockets and state before serving
+    def take_over(self, fd):
+        with socket.socket(fileno=fd) as conn:
+            conn.settimeout(handoff.TIMEOUT)
+            state, fds = handoff.receive_state(conn)
+            self.restore_state(state, fds)
+            conn.sendall(b"OK")
+        print(f"Took over {len(self.listeners)} listener(s) and {len(self.clients)} client(s)")
+
+    # Start a new server process, hand it every socket and exit without dropping anyone
+    # The handoff runs over a socketpair inherited by the child, so no other process can connect to it
+    def restart(self):
+        process = None
+        try:
+            conn, child_end = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+        except OSError as e:
+            print("Error: Graceful restart failed, still serving.", e)
+            return
+        command = [sys.executable, os.path.abspath(__file__), "--takeover-fd", str(child_end.fileno())]
+        if self.config_path:
+            command += ["--config", self.config_path]
+        try:
+            with conn:
+                with child_end:
+                    process = subprocess.Popen(command, pass_fds=[child_end.fileno()])
+                conn.settimeout(handoff.TIMEOUT)
+                state, fds = self.serialize_state()
+                handoff.send_state(conn, state, fds)
+                if handoff.recv_exactly(conn, 2) != b"OK":
+                    raise ConnectionError("new process did not confirm the handoff")
+        except (OSError, ConnectionError) as e:
+            print("Error: Graceful restart failed, still serving.", e)
+            if process:
+                process.terminate()
+            return
+        print("Handed over to new process", process.pid)
+        # Our copies of the sockets close on exit, the new process keeps the connections open
+        self.running = False
+
     # Handle the client
     def handle_client(self, client):
         try:
@@ -157,9 +364,9 @@ class Server:
         current_time = datetime.datetime.now()
         for client in list(self.clients.values()):
             time_difference = (current_time - client.last_activity).total_seconds()
-            if time_difference > 60:
+            if time_difference > self.config["ping_interval"]:
                 if client.ping_sent:
-                    if (current_time - client.ping_sent_time).total_seconds() > 60:
+                    if (current_time - client.ping_sent_time).total_seconds() > self.config["ping_timeout"]:
                         self.handle_quit(client, ["QUIT", ":Ping timeout"])
                 else:
                     self.send_ping(client)
@@ -177,10 +384,28 @@ class Server:
         client.last_activity = datetime.datetime.now()
         print(f"[{client.address[0]}:{client.address[1]}] → PONG received")
 
+    # Look up a channel by name, ignoring case
+    def get_channel(self, name):
+        return self.channels.get(channel_key(name))
+
+    # Remove a client from a channel and drop the channel once it is empty
+    def leave_channel(self, client, channel):
+        client.leave_channel(channel)
+        if channel.is_empty():
+            self.channels.pop(channel_key(channel.name), None)
+
+    # Every client sharing at least one channel with client, each listed once
+    def channel_peers(self, client):
+        peers = set()
+        for channel in client.channels:
+            peers.update(channel.clients)
+        peers.discard(client)
+        return peers
+
     # Remove a client from the server
     def remove_client(self, client):
         for channel in list(client.channels):
-            client.leave_channel(channel)
+            self.leave_channel(client, channel)
         del self.clients[client.socket]
         client.socket.close()
         print("Client", client.address, "disconnected")
@@ -198,8 +423,55 @@ class Server:
             client.send_message("421 * " + command + " :Unknown command")
             print(f"[{client.address[0]}:{client.address[1]}] → Error 421: Unknown command\r\n")
 
+    # Send lines framed in one BATCH if the client supports it, otherwise as they are
+    def send_batch(self, client, batch_type, target, lines):
+        if "batch" not in client.caps:
+            for line in lines:
+                client.send_message(line)
+            return
+        ref = f"b{next(self.batch_refs)}"
+        client.send_message(f":IRCserver BATCH +{ref} {batch_type} {target}")
+        for line in lines:
+            client.send_message(f"@batch={ref} {line}")
+        client.send_message(f":IRCserver BATCH -{ref}")
+
+    # Handle CAP command, negotiation holds registration back until CAP END
     def handle_cap(self, client, parts):
-        print(f"[{client.address[0]}:{client.address[1]}] CAP: {parts[1]} {parts[2]}")
+        if len(parts) < 2:
+            client.send_message("461 * CAP :Not enough parameters")
+            print(f"[{client.address[0]}:{client.address[1]}] → Error 461: Not enough parameters")
+            return
+
+        subcommand = parts[1].upper()
+        nick = client.nickname or "*"
+        if subcommand == "LS":
+            if not client.registered:
+                client.cap_negotiating = True
+            client.send_message(f":IRCserver CAP {nick} LS :{' '.join(SUPPORTED_CAPS)}")
+        elif subcommand == "LIST":
+            client.send_message(f":IRCserver CAP {nick} LIST :{' '.join(sorted(client.caps))}")
+        elif subcommand == "REQ":
+            if not client.registered:
+                client.cap_negotiating = True
+            requested = " ".join(parts[2:]).lstrip(":").split()
+            # The request is accepted or rejected as a whole
+            if requested and all(cap.lstrip("-") in SUPPORTED_CAPS for cap in requested):
+                for cap in requested:
+                    if cap.startswith("-"):
+                        client.caps.discard(cap[1:])
+                    else:
+                        client.caps.add(cap)
+                client.send_message(f":IRCserver CAP {nick} ACK :{' '.join(requested)}")
+            else:
+                client.send_message(f":IRCserver CAP {nick} NAK :{' '.join(requested)}")
+        elif subcommand == "END":
+            client.cap_negotiating = False
+            if client.user_pending:
+                client.user_pending = False
+                self.send_welcome(client)
+        else:
+            client.send_message(f":IRCserver 410 {nick} {subcommand} :Invalid CAP command")
+        print(f"[{client.address[0]}:{client.address[1]}] CAP: {' '.join(parts[1:])}")
 
     # Handle NICK command
     def handle_nick(self, client, parts):
@@ -223,8 +495,7 @@ class Server:
 
         # Notify other clients about the nickname change
         if client.nickname:
-            for channel in client.channels:
-                channel.broadcast(f":{client.nickname}!{client.nickname}@{client.address[0]} NICK :{new_nick}")
+            chan.send(self.channel_peers(client), f":{client.nickname}!{client.nickname}@{client.address[0]} NICK :{new_nick}")
 
         old_nick = client.nickname
         client.nickname = new_nick
@@ -262,19 +533,27 @@ class Server:
         if len(parts) < 5:
             client.send_message("461 * USER :Not enough parameters")
             print(f"[{client.address[0]}:{client.address[1]}] → Error 461: Not enough parameters")
+        elif client.cap_negotiating:
+            # Finish registration once the client sends CAP END
+            client.user_pending = True
         else:
-            client.send_message(":IRCserver 001 " + client.nickname + " :Welcome to the IRC Network")
-            print(f"[{client.address[0]}:{client.address[1]}] → 001 :Welcome to the IRC Network")
-            # MOTD File is missing means there is no message to display
-            client.send_message(":IRCserver 422 " + client.nickname + " :MOTD File is missing")
-            print(f"[{client.address[0]}:{client.address[1]}] → 422 :MOTD file is missing")
+            self.send_welcome(client)
+
+    # Complete registration
+    def send_welcome(self, client):
+        client.registered = True
+        client.send_message(":IRCserver 001 " + client.nickname + " :Welcome to the IRC Network")
+        print(f"[{client.address[0]}:{client.address[1]}] → 001 :Welcome to the IRC Network")
+        # MOTD File is missing means there is no message to display
+        client.send_message(":IRCserver 422 " + client.nickname + " :MOTD File is missing")
+        print(f"[{client.address[0]}:{client.address[1]}] → 422 :MOTD file is missing")
 
     # Log the user's status
     def handle_log(self, status, nick, time, client):
         logMsg = f"[{client.address[0]}:{client.address[1]}] ← User {nick} {status} at {time}\n"
         print(logMsg)
         # Write the log message to a file
-        with open("log.txt", "a") as log:
+        with open(self.config["log_file"], "a") as log:
             log.write(logMsg)
 
     # Handle JOIN command
@@ -283,20 +562,25 @@ class Server:
             client.send_message(":IRCserver 461 * JOIN :Not enough parameters")
             print(f"[{client.address[0]}:{client.address[1]}] → Error 461 Not enough parameters")
         else:
-            channel_name = parts[1]
-            if channel_name not in self.channels:
-                self.channels[channel_name] = Channel(channel_name)
-            channel = self.channels[channel_name]
-            client.join_channel(channel)
-            channel.add_client(client)
-            # Notify other clients in the channel
-            channel.broadcast(":" + client.nickname + "!" + client.nickname + "@" + client.address[0] + " JOIN " + channel_name)
-            # Send the client the list of users in the channel
-            channel.display_clients()
-            print(f"[{client.address[0]}:{client.address[1]}] → : 353 {client.nickname} : {channel_name}")
-            self.handle_names(client, ["NAMES", channel_name])
-            time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            self.handle_log("connected", client.nickname, time, client)
+            # JOIN accepts a comma separated list of channels
+            for channel_name in parts[1].split(","):
+                if channel_name:
+                    self.join_channel(client, channel_name)
+
+    def join_channel(self, client, channel_name):
+        channel = self.get_channel(channel_name)
+        if not channel:
+            channel = Channel(channel_name)
+            self.channels[channel_key(channel_name)] = channel
+        client.join_channel(channel)
+        # Notify other clients in the channel
+        channel.broadcast(":" + client.nickname + "!" + client.nickname + "@" + client.address[0] + " JOIN " + channel.name)
+        # Send the client the list of users in the channel
+        channel.display_clients()
+        print(f"[{client.address[0]}:{client.address[1]}] → : 353 {client.nickname} : {channel_name}")
+        self.handle_names(client, ["NAMES", channel.name])
+        time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self.handle_log("connected", client.nickname, time, client)
 
     # Handle PRIVMSG command
     def handle_privmsg(self, client, parts):
@@ -316,15 +600,23 @@ class Server:
                     target_client = c
                     break
             
-            if target in self.channels:
-                channel = self.channels[target]
+            channel = self.get_channel(target)
+            # Channel messages carry the channel's own spelling so every member sees one name
+            line = ":" + client.nickname + "!" + client.nickname + "@" + client.address[0] + " PRIVMSG " + (channel.name if channel else target) + " :" + message
+            time = server_time()
+            if channel:
                 if client in channel.clients:
-                    channel.broadcast(":" + client.nickname + "!" + client.nickname + "@" + client.address[0] + " PRIVMSG " + target + " :" + message, client)
+                    channel.broadcast(line, client, time)
+                    # echo-message saves the sender keeping its own copy
+                    if "echo-message" in client.caps:
+                        client.send_message(line, time)
                 else:
                     client.send_message(":IRCserver 442 * " + target + " :You're not on that channel")
                     print(f"[{client.address[0]}:{client.address[1]}] → Error 442 You're not on that channel")
             elif target_client:
-                target_client.send_message(":" + client.nickname + "!" + client.nickname + "@" + client.address[0] + " PRIVMSG " + target + " :" + message)
+                target_client.send_message(line, time)
+                if "echo-message" in client.caps:
+                    client.send_message(line, time)
                 print(f"[{client.address[0]}:{client.address[1]}]→ : {client.nickname} sending {message} to {target}")
             else:
                 client.send_message(":IRCserver 401 * " + target + " :No such nickname/channel")
@@ -337,10 +629,12 @@ class Server:
         self.handle_log("disconnected", client.nickname, time, client)
         if len(parts) > 1:
             quit_message = " ".join(parts[1:])[1:]
+        # Each peer gets the QUIT once, however many channels they share
+        chan.send(self.channel_peers(client), ":" + client.nickname + "!" + client.nickname + "@" + client.address[0] + " QUIT :" + quit_message)
         for channel in list(client.channels):
-            channel.broadcast(":" + client.nickname + "!" + client.nickname + "@" + client.address[0] + " QUIT " + channel.name + " :" + quit_message)
-            client.leave_channel(channel)
-            channel.display_clients()
+            self.leave_channel(client, channel)
+            if not channel.is_empty():
+                channel.display_clients()
         self.remove_client(client)
 
     # Handle PING command
@@ -353,12 +647,26 @@ class Server:
             print(f"[{client.address[0]}:{client.address[1]}] received PING replying with PONG {parts[1]}")
             client.last_activity = datetime.datetime.now()
 
+# Parse command-line arguments
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="IRC Server")
+    parser.add_argument("--config", default=None, help="Config file, server.conf is used if it exists")
+    parser.add_argument("--takeover-fd", type=int, default=None, help="Inherited socket to take over a running server from, set by a graceful restart")
+    return parser.parse_args()
+
 # Main function to start the server
 def main():
-    SERVER = "::1"
-    PORT = 6667
-    server = Server(SERVER, PORT)
-    server.start()
+    args = parse_arguments()
+    config_path = args.config
+    if config_path is None and os.path.exists("server.conf"):
+        config_path = "server.conf"
+    try:
+        config = load_config(config_path)
+    except (OSError, ValueError, configparser.Error) as e:
+        print("Error: Cannot load config.", e)
+        return
+    server = Server(config, config_path)
+    server.start(args.takeover_fd)
 
 # Entry point of the script
 if __name__ == "__main__":
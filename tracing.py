@@ -0,0 +1,114 @@
+# Opt-in latency tracing and sampling profiler for the server and bot
+# Nothing here runs unless tracing is turned on, handlers are only wrapped when it is
+import os
+import signal
+import time
+
+# Histogram class to count call durations in power-of-two microsecond buckets
+class Histogram:
+    __slots__ = ("buckets", "count", "total", "max")
+
+    def __init__(self):
+        # buckets[i] counts calls that took less than 2**i microseconds
+        self.buckets = [0] * 32
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        # Add one call that took seconds
+        micros = int(seconds * 1_000_000)
+        self.buckets[min(micros.bit_length(), 31)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, fraction):
+        # Upper bound in seconds of the bucket holding the given fraction of calls
+        target = self.count * fraction
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if n and seen >= target:
+                return min((1 << i) / 1_000_000, self.max)
+        return self.max
+
+# Tracer class to hold per-command histograms and run the sampling profiler
+class Tracer:
+    def __init__(self, profile_file="profile.folded", interval=0.005):
+        self.histograms = {}
+        self.profile_file = profile_file
+        self.interval = interval
+        # Folded stack -> number of samples
+        self.samples = {}
+        self.profiling = False
+
+    def wrap(self, name, handler):
+        # Return handler timed into the histogram for name
+        histogram = self.histograms.setdefault(name, Histogram())
+        clock = time.perf_counter
+
+        def traced(*args, **kwargs):
+            start = clock()
+            try:
+                return handler(*args, **kwargs)
+            finally:
+                histogram.record(clock() - start)
+
+        traced.__name__ = getattr(handler, "__name__", name)
+        traced.__wrapped__ = handler
+        return traced
+
+    def report(self):
+        # One line per traced name, slowest total time first
+        lines = []
+        for name, h in sorted(self.histograms.items(), key=lambda item: item[1].total, reverse=True):
+            if not h.count:
+                continue
+            lines.append(f"{name}: {h.count} calls, avg {h.total / h.count * 1000:.3f}ms, "
+                         f"p50 {h.percentile(0.5) * 1000:.3f}ms, p99 {h.percentile(0.99) * 1000:.3f}ms, "
+                         f"max {h.max * 1000:.3f}ms")
+        return lines
+
+    def sample(self, signum, frame):
+        # SIGPROF handler, records the interrupted stack in folded form
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+        key = ";".join(reversed(stack))
+        self.samples[key] = self.samples.get(key, 0) + 1
+
+    def start_profile(self):
+        # Start sampling the main thread every interval seconds of CPU time
+        self.samples = {}
+        self.profiling = True
+        signal.signal(signal.SIGPROF, self.sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop_profile(self):
+        # Stop sampling and write the stacks in flamegraph.pl / speedscope folded format
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, signal.SIG_DFL)
+        self.profiling = False
+        with open(self.profile_file, "w") as f:
+            for stack, count in sorted(self.samples.items()):
+                f.write(f"{stack} {count}\n")
+        return sum(self.samples.values())
+
+    def toggle_profile(self, signum=None, frame=None):
+        # Start the profiler, or stop it and dump the profile and latency report
+        if not self.profiling:
+            self.start_profile()
+            print(f"Profiler started, send the signal again to write {self.profile_file}")
+            return
+        count = self.stop_profile()
+        print(f"Profiler wrote {count} samples to {self.profile_file}")
+        for line in self.report():
+            print(line)
+
+    def install_signal_handler(self, signum=signal.SIGUSR1):
+        # Toggle the profiler when signum arrives
+        signal.signal(signum, self.toggle_profile)